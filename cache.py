@@ -1,57 +1,82 @@
+import json
+import os
+
 from lxml import etree
-import pandas as pd
+import openpyxl
+
+from xml_utils import discard
 
 
 class Cache:
     def __init__(self, path: str) -> None:
         self.path = path
+        self.dirty = False
         try:
-            file = etree.parse(self.path)
-            self.memory = {}
-            for element in file.getroot():
-                id = element.attrib["id"]
-                data = {}
-                for el in element:
-                    data[el.tag] = el.text
-                self.memory[id] = data
-        except (FileNotFoundError, OSError):
-            self.memory = {}
+            with open(self.path, encoding="utf-8") as f:
+                self.memory = json.load(f)
+        except FileNotFoundError:
+            self.memory = self.read_xml(os.path.splitext(self.path)[0] + ".xml")
+            self.dirty = bool(self.memory)
+
+    @staticmethod
+    def read_xml(path: str) -> dict:
+        # Caches used to be stored as XML, read them so they get migrated on flush
+        if not os.path.exists(path):
+            return {}
+        memory = {}
+        # Stream the items and free each one once it has been read
+        for event, element in etree.iterparse(path, events=("end",), tag="item"):
+            memory[element.get("id")] = {el.tag: el.text for el in element}
+            discard(element)
+        return memory
+
+    def set(self, id, key, value):
+        self.memory.setdefault(id, {})[key] = value
+        self.dirty = True
 
     def flush(self):
-        with etree.xmlfile(self.path, encoding="utf-8") as xf:
-            xf.write_declaration()
-            root = etree.Element("cache")
-            for id, data in self.memory.items():
-                el = etree.SubElement(root, "item", id=id)
-                for key, value in data.items():
-                    el2 = etree.SubElement(el, key)
-                    el2.text = value
-            xf.write(root, pretty_print=True)
+        # Nothing to write if the cache hasn't changed since it was loaded or flushed
+        if not self.dirty:
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.memory, f, ensure_ascii=False, indent=2)
+        self.dirty = False
 
 
 class CompanyCache(Cache):
     def fill_isin_cache(self, additional_info_file):
-        info = pd.read_excel(additional_info_file, sheet_name=0)
-        for _, row in info.iterrows():
-            self.set_isin(row["Instrument Symbol"], row["Instrument ISIN"])
+        # Stream the rows of the first sheet and only pick the two columns we need
+        workbook = openpyxl.load_workbook(
+            additional_info_file, read_only=True, data_only=True
+        )
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows)
+            symbol_index = header.index("Instrument Symbol")
+            isin_index = header.index("Instrument ISIN")
+            for row in rows:
+                if row[symbol_index] is not None:
+                    self.set_isin(row[symbol_index], row[isin_index])
+        finally:
+            workbook.close()
 
     def get_isin(self, symbol):
         return self.memory.get(symbol, {}).get("isin")
 
     def set_isin(self, symbol, isin):
-        if symbol in self.memory:
-            self.memory[symbol]["isin"] = isin
-        else:
-            self.memory[symbol] = {"isin": isin}
+        self.set(symbol, "isin", isin)
 
     def get_address(self, symbol):
         return self.memory.get(symbol, {}).get("address")
 
     def set_address(self, symbol, address):
-        if symbol in self.memory:
-            self.memory[symbol]["address"] = address
-        else:
-            self.memory[symbol] = {"address": address}
+        self.set(symbol, "address", address)
+
+    def get_address_not_found(self, symbol):
+        return self.memory.get(symbol, {}).get("address_not_found")
+
+    def set_address_not_found(self, symbol, date):
+        self.set(symbol, "address_not_found", date)
 
 
 class CountryCache(Cache):
@@ -59,16 +84,10 @@ class CountryCache(Cache):
         return self.memory.get(country, {}).get("relief_statement")
 
     def set_relief_statement(self, country, relief_statement):
-        if country in self.memory:
-            self.memory[country]["relief_statement"] = relief_statement
-        else:
-            self.memory[country] = {"relief_statement": relief_statement}
+        self.set(country, "relief_statement", relief_statement)
 
     def get_country_name(self, country):
         return self.memory.get(country, {}).get("name")
 
     def set_country_name(self, country, name):
-        if country in self.memory:
-            self.memory[country]["name"] = name
-        else:
-            self.memory[country] = {"name": name}
+        self.set(country, "name", name)
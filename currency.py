@@ -1,18 +1,45 @@
 from lxml import etree
+import pandas as pd
+
+from xml_utils import discard
+
+CURRENCIES = frozenset(("USD", "CAD"))
 
 
 def get_currency(dates):
+    # Missing dates have no rate, the callers report them as such
+    dates = frozenset(pd.DatetimeIndex(dates).dropna().strftime("%Y-%m-%d"))
+    # The BSI file lists the exchange rates in chronological order
+    max_date = max(dates, default="")
     results = {}
     for event, element in etree.iterparse(
-        "data/currency.xml", tag="{http://www.bsi.si}tecajnica"
+        "data/currency.xml",
+        tag="{http://www.bsi.si}tecajnica",
+        events=("end",),
+        huge_tree=True,
+        collect_ids=False,
+        remove_blank_text=True,
+        remove_comments=True,
     ):
-        date = element.attrib["datum"]
+        date = element.get("datum")
+        if date not in dates:
+            discard(element)
+            if date > max_date:
+                break
+            continue
         currencies = {}
-        for child in element if date in dates else []:
-            currency = child.attrib["oznaka"]
-            if currency == "USD" or currency == "CAD":
+        for child in element.iterchildren("{http://www.bsi.si}tecaj"):
+            currency = child.get("oznaka")
+            if currency in CURRENCIES:
                 currencies[currency] = float(child.text)
         if len(currencies) > 0:
             results[date] = currencies
-        element.clear()
-    return results
+        discard(element)
+        if len(results) == len(dates):
+            break
+    # One row per date and one column per currency
+    rates = pd.DataFrame.from_dict(
+        results, orient="index", columns=sorted(CURRENCIES), dtype=float
+    )
+    rates.index = pd.to_datetime(rates.index, format="%Y-%m-%d")
+    return rates
@@ -1,18 +1,74 @@
 import sys
 
+import numpy as np
 import pandas as pd
 import currency
 from cache import CompanyCache, CountryCache
 import argparse
 from finance import FinanceData
-from xml_output import XML, XMLWriter
+from xml_output import XML, XMLWriter, E, EDP, sub_element
 from taxpayer import Taxpayer
-from lxml.builder import ElementMaker
+from lxml import etree
 from gains import DohKDVP, KDVPSecurityOpen, KDVPSecurityClose
 
+# Columns of the Saxo exports that are used, the rest is skipped while reading
+DIVIDEND_COLUMNS = [
+    "Event",
+    "Instrument",
+    "Instrument Symbol",
+    "Pay Date",
+    "Dividend amount",
+    "Withholding tax amount",
+]
+GAINS_COLUMNS = [
+    "Instrument Symbol",
+    "Instrument currency",
+    "Asset type",
+    "Trade Date Open",
+    "Trade Date Close",
+    "Quantity Open",
+    "QuantityClose",
+    "Open Price",
+    "Close Price",
+]
+
+
+def to_eur(amounts, dates, rates):
+    # Split the amounts like "USD12.34" into the currency and the value
+    currencies = amounts.str.slice(0, 3).to_numpy()
+    unsupported = ~np.isin(currencies, ["EUR", *rates.columns])
+    if unsupported.any():
+        print("Currency not supported: ", amounts[unsupported].iloc[0])
+        sys.exit(1)
+    values = pd.to_numeric(amounts.str.slice(3), errors="coerce").to_numpy()
+    invalid = np.isnan(values)
+    if invalid.any():
+        print("Amount could not be parsed: ", amounts[invalid].iloc[0])
+        sys.exit(1)
+    # Pick the rate of each row's currency on its date, EUR amounts stay as they are
+    day_rates = rates.reindex(dates)
+    conversion = np.select(
+        [currencies == code for code in rates.columns],
+        [day_rates[code].to_numpy() for code in rates.columns],
+        default=1.0,
+    )
+    missing = np.isnan(conversion)
+    if missing.any():
+        print("Exchange rate not found for ", dates[missing].iloc[0])
+        sys.exit(1)
+    return pd.Series(values / conversion, index=amounts.index)
+
+
 def dividends(args, company_cache, country_cache):
     # Open dividends xlsx file
-    df = pd.read_excel(args.dividends, sheet_name="Share Dividends")
+    df = pd.read_excel(
+        args.dividends,
+        sheet_name="Share Dividends",
+        engine="calamine",
+        usecols=DIVIDEND_COLUMNS,
+        # The event is only compared against, keep it as codes instead of strings
+        dtype={"Event": "category"},
+    )
     print("Opened dividends file: ", args.dividends)
 
     # Rename the columns
@@ -26,89 +82,61 @@ def dividends(args, company_cache, country_cache):
         }
     )
 
-    # Add a couple more columns that are required by the FURS XML schema and set them as null
-    furs_df["ReliefStatement"] = None
-    furs_df["PayerAddress"] = None
-    furs_df["PayerIdentificationNumber"] = None
-    furs_df["PayerCountry"] = None
+    # Parse the pay dates, failing on any value that doesn't match the format
+    furs_df["Date"] = pd.to_datetime(furs_df["Date"], format="%d-%b-%Y")
 
-    # Parse the date values in the Date column and convert them to the format YYYY-MM-DD
-    furs_df["Date"] = pd.to_datetime(furs_df["Date"], format="%d-%b-%Y").dt.strftime(
-        "%Y-%m-%d"
-    )
+    # Filter the rows to only include the ones with the event "Cash dividend",
+    # before fetching any rates or payer data for rows that would be discarded
+    furs_df = furs_df.loc[furs_df["Event"] == "Cash dividend"].copy()
 
     # Get the exchange rate for the dates in the Date column
-    exchange_rates = currency.get_currency(furs_df["Date"].unique())
+    rates = currency.get_currency(furs_df["Date"].unique())
 
     finance_data = FinanceData(company_cache)
     symbols = furs_df["Symbol"].unique()
     finance_data.fetch_info(symbols)
+    # Persist the lookups right away so an aborted run doesn't have to repeat them
+    company_cache.flush()
+    isin_map = {symbol: finance_data.get_isin(symbol) for symbol in symbols}
+    address_map = {symbol: finance_data.get_address(symbol) for symbol in symbols}
 
-    def process_row(row):
-        # Dividend amount
-        if row["Value"].startswith("USD"):
-            value = float(row["Value"].replace("USD", ""))
-            row["Value"] = value / exchange_rates[row["Date"]]["USD"]
-        elif row["Value"].startswith("CAD"):
-            value = float(row["Value"].replace("CAD", ""))
-            row["Value"] = value / exchange_rates[row["Date"]]["CAD"]
-        elif row["Value"].startswith("EUR"):
-            row["Value"] = float(row["Value"].replace("EUR", ""))
-        else:
-            print("Currency not supported: ", row["Value"])
-            sys.exit(1)
-        # Tax witheld at source
-        foreign_tax = row["ForeignTax"].lstrip(" +-")
-        if foreign_tax.startswith("USD"):
-            value = float(foreign_tax.replace("USD", ""))
-            row["ForeignTax"] = value / exchange_rates[row["Date"]]["USD"]
-        elif foreign_tax.startswith("CAD"):
-            value = float(foreign_tax.replace("CAD", ""))
-            row["ForeignTax"] = value / exchange_rates[row["Date"]]["CAD"]
-        elif foreign_tax.startswith("EUR"):
-            row["ForeignTax"] = float(foreign_tax.replace("EUR", ""))
-        else:
-            print("Currency not supported: ", row["ForeignTax"])
-            sys.exit(1)
-        # Payer identification number
-        if not row["PayerIdentificationNumber"]:
-            isin = finance_data.get_isin(row["Symbol"])
-            if not isin:
-                isin = input("Enter the ISIN for {}: ".format(row["PayerName"]))
-                company_cache.set_isin(row["Symbol"], isin)
-            row["PayerIdentificationNumber"] = isin
-        # Payer country
-        if not row["PayerCountry"]:
-            row["PayerCountry"] = row["PayerIdentificationNumber"][:2]
-        # Payer address
-        if not row["PayerAddress"]:
-            address = finance_data.get_address(row["Symbol"])
-            if not address:
-                address = input(
-                    "Enter the payer address for {}: ".format(row["PayerName"])
-                )
-                company_cache.set_address(row["Symbol"], address)
-            row["PayerAddress"] = address
-        # Relief statement
-        if not row["ReliefStatement"]:
-            statement = country_cache.get_relief_statement(row["PayerCountry"])
-            if not statement:
-                statement = input(
-                    "Enter the relief statement for country {}: ".format(
-                        row["PayerCountry"]
-                    )
-                )
-                country_cache.set_relief_statement(row["PayerCountry"], statement)
-            row["ReliefStatement"] = statement
-        # Flush the caches for each rown
-        company_cache.flush()
-        country_cache.flush()
-        return row
+    # Convert the dividend amount and the tax witheld at source to EUR
+    furs_df["Value"] = to_eur(furs_df["Value"], furs_df["Date"], rates)
+    furs_df["ForeignTax"] = to_eur(
+        furs_df["ForeignTax"].str.lstrip(" +-"), furs_df["Date"], rates
+    )
 
-    # Filter the rows to only include the ones with the event "Cash dividend"
-    furs_df = furs_df[furs_df["Event"] == "Cash dividend"]
-    # Process the rows (convert currencies, get missing data from the user, etc.)
-    furs_df = furs_df.apply(process_row, axis=1)
+    # Ask the user for the payer data that isn't cached, once per payer
+    payers = furs_df.drop_duplicates("Symbol")
+    for symbol, name in zip(payers["Symbol"], payers["PayerName"]):
+        if not isin_map[symbol]:
+            isin_map[symbol] = input("Enter the ISIN for {}: ".format(name))
+            company_cache.set_isin(symbol, isin_map[symbol])
+        if not address_map[symbol]:
+            address_map[symbol] = input(
+                "Enter the payer address for {}: ".format(name)
+            )
+            company_cache.set_address(symbol, address_map[symbol])
+    # Add the columns that are required by the FURS XML schema
+    furs_df["PayerIdentificationNumber"] = (
+        furs_df["Symbol"].map(isin_map).astype("string")
+    )
+    # The country is the ISIN prefix, sliced for the whole column at once
+    furs_df["PayerCountry"] = furs_df["PayerIdentificationNumber"].str[:2]
+    furs_df["PayerAddress"] = furs_df["Symbol"].map(address_map)
+    # Relief statements are per country, so ask for each missing country only once
+    relief_statements = {}
+    for country in furs_df["PayerCountry"].unique():
+        statement = country_cache.get_relief_statement(country)
+        if not statement:
+            statement = input(
+                "Enter the relief statement for country {}: ".format(country)
+            )
+            country_cache.set_relief_statement(country, statement)
+        relief_statements[country] = statement
+    furs_df["ReliefStatement"] = furs_df["PayerCountry"].map(relief_statements)
+    company_cache.flush()
+    country_cache.flush()
 
     # Output some informational info (e.g. the total amount of dividends)
     total_dividends = round(furs_df["Value"].sum(), 2)
@@ -131,85 +159,123 @@ def dividends(args, company_cache, country_cache):
 
 def gains(args):
     # Open gains xlsx file
-    df = pd.read_excel(args.gains, sheet_name="ClosedPositions")
+    # The currency and asset type have only a few distinct values and are only
+    # compared against, keep them as codes instead of strings
+    df = pd.read_excel(
+        args.gains,
+        sheet_name="ClosedPositions",
+        engine="calamine",
+        usecols=GAINS_COLUMNS,
+        dtype={"Instrument currency": "category", "Asset type": "category"},
+    )
     print("Opened gains file: ", args.gains)
 
-    # Parse the date values in the Date column and convert them to the format YYYY-MM-DD
-    df["Trade Date Open"] = pd.to_datetime(
-        df["Trade Date Open"], format="%d-%b-%Y"
-    ).dt.strftime("%Y-%m-%d")
-    df["Trade Date Close"] = pd.to_datetime(
-        df["Trade Date Close"], format="%d-%b-%Y"
-    ).dt.strftime("%Y-%m-%d")
-
-    # Get the exchange rate for the dates in the Date column
-    dates = list(df["Trade Date Open"]) + list(df["Trade Date Close"])
-    exchange_rates = currency.get_currency(dates)
-
-    def process_row(row):
-        # Process the currency of the trade
-        conversion_open = 1
-        conversion_close = 1
-        if row["Instrument currency"] == "USD":
-            conversion_open = exchange_rates[row["Trade Date Open"]]["USD"]
-            conversion_close = exchange_rates[row["Trade Date Close"]]["USD"]
-        row["Open Price"] = float(row["Open Price"]) / conversion_open
-        row["Close Price"] = float(row["Close Price"]) / conversion_close
-        # Clean up the symbol
-        row["Symbol"] = row["Instrument Symbol"].split(":")[0]
-        # Clean up quantities
-        row["QuantityOpen"] = float(row["Quantity Open"])
-        row["QuantityClose"] = abs(float(row["QuantityClose"]))
-        # Gain
-        row["Gain"] = (row["QuantityClose"] * row["Close Price"]) - (
-            row["QuantityOpen"] * row["Open Price"]
+    # Parse the dates of both columns and number the unique ones, the open dates are
+    # followed by the close dates so the codes can be split back per column
+    codes, dates = pd.factorize(
+        pd.concat(
+            [
+                pd.to_datetime(df["Trade Date Open"], format="%d-%b-%Y"),
+                pd.to_datetime(df["Trade Date Close"], format="%d-%b-%Y"),
+            ],
+            ignore_index=True,
         )
-        return row
-
-    # Process the rows (convert currencies, get missing data from the user, etc.)
-    df = df.apply(process_row, axis=1)
+    )
+    codes_open, codes_close = codes[: len(df)], codes[len(df) :]
+    # Blank dates get the code -1, which would pick another trade's date
+    missing = (codes_open < 0) | (codes_close < 0)
+    if missing.any():
+        print("Trade date not found for ", df[missing].iloc[0].to_dict())
+        sys.exit(1)
+    # Only the unique dates need to be formatted as YYYY-MM-DD
+    labels = dates.strftime("%Y-%m-%d").to_numpy()
+    df["Trade Date Open"] = labels[codes_open]
+    df["Trade Date Close"] = labels[codes_close]
+
+    # Get the exchange rate for the unique dates
+    usd_rates = currency.get_currency(dates)["USD"].reindex(dates).to_numpy()
+
+    # Convert the prices of the trades in USD to EUR
+    usd = df["Instrument currency"] == "USD"
+    conversion_open = np.where(usd, usd_rates[codes_open], 1.0)
+    conversion_close = np.where(usd, usd_rates[codes_close], 1.0)
+    # The trades without a date were rejected above, so a NaN can only be a missing rate
+    missing = np.isnan(conversion_open) | np.isnan(conversion_close)
+    if missing.any():
+        print("Exchange rate not found for ", df[missing].iloc[0].to_dict())
+        sys.exit(1)
+    df["Open Price"] = df["Open Price"].astype(float) / conversion_open
+    df["Close Price"] = df["Close Price"].astype(float) / conversion_close
+    # Clean up the symbol
+    df["Symbol"] = df["Instrument Symbol"].str.split(":", n=1).str[0]
+    # Clean up quantities
+    df["QuantityOpen"] = df["Quantity Open"].astype(float)
+    df["QuantityClose"] = df["QuantityClose"].astype(float).abs()
+    # Gain
+    df["Gain"] = (df["QuantityClose"] * df["Close Price"]) - (
+        df["QuantityOpen"] * df["Open Price"]
+    )
 
     # Output some informational info (e.g. the total amount of gains and losses)
     print("Number of trades: ", df.shape[0])
 
     # Convert the dataframe to typed DohKDVP objects
     doh_kdvp = DohKDVP()
-    for i, row in df.iterrows():
-        trade_open = KDVPSecurityOpen(
-            row["Trade Date Open"], row["QuantityOpen"], row["Open Price"], 0, "B"
-        )
-        doh_kdvp.add_trade(row.Symbol, trade_open, row["Asset type"] != "Stock")
+    columns = [
+        "Symbol",
+        "Asset type",
+        "Trade Date Open",
+        "QuantityOpen",
+        "Open Price",
+        "Trade Date Close",
+        "QuantityClose",
+        "Close Price",
+        "Gain",
+    ]
+    for (
+        symbol,
+        asset_type,
+        date_open,
+        quantity_open,
+        price_open,
+        date_close,
+        quantity_close,
+        price_close,
+        gain,
+    ) in df[columns].itertuples(index=False, name=None):
+        is_fond = asset_type != "Stock"
+        trade_open = KDVPSecurityOpen(date_open, quantity_open, price_open, 0, "B")
+        doh_kdvp.add_trade(symbol, trade_open, is_fond)
         trade_close = KDVPSecurityClose(
-            row["Trade Date Close"], row["QuantityClose"], row["Close Price"], 0, row["Gain"] < 0
+            date_close, quantity_close, price_close, 0, gain < 0
         )
-        doh_kdvp.add_trade(row.Symbol, trade_close, row["Asset type"] != "Stock")
+        doh_kdvp.add_trade(symbol, trade_close, is_fond)
     
     # Load taxpayer data
     taxpayer = Taxpayer()
     taxpayer.get_input()
 
     # Generate the XML structure
-    EDP_NS = "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd"
-    E = ElementMaker(nsmap={"edp": EDP_NS})
-    EDP = ElementMaker(namespace=EDP_NS)
-    envelope = E.Envelope(
-        {"xmlns": "http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd"},
-        EDP.Header(
-            EDP.taxpayer(
-                EDP.taxNumber(taxpayer.taxNumber),
-                EDP.taxpayerType("FO"),
-                EDP.name(taxpayer.name),
-                EDP.address1(taxpayer.address),
-                EDP.city(taxpayer.city),
-                EDP.postNumber(taxpayer.postNumber),
-                EDP.birthDate(taxpayer.birthDate),
-            ),
+    header = EDP.Header(
+        EDP.taxpayer(
+            EDP.taxNumber(taxpayer.taxNumber),
+            EDP.taxpayerType("FO"),
+            EDP.name(taxpayer.name),
+            EDP.address1(taxpayer.address),
+            EDP.city(taxpayer.city),
+            EDP.postNumber(taxpayer.postNumber),
+            EDP.birthDate(taxpayer.birthDate),
         ),
-        EDP.AttachmentList(),
-        EDP.Signatures(),
-        E.body(
-            EDP.bodyContent(),
-            E.Doh_KDVP(
+    )
+
+    # Write the final XML file, streaming one item at a time
+    xml = XMLWriter(args.output or "gains_furs.xml")
+    with xml.envelope(
+        "http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd", header
+    ) as body:
+        body.write(EDP.bodyContent())
+        with body.element("Doh_KDVP") as doh_kdvp_element:
+            doh_kdvp_element.write(
                 E.KDVP(
                     E.DocumentWorkflowID("O"),
                     E.Year(str(pd.Timestamp.now().year - 1)),
@@ -224,49 +290,41 @@ def gains(args):
                     E.ShareCount("0"),
                     E.SecurityCapitalReductionCount("0"),
                     E.Email(taxpayer.email),
-                ),
-                *[
-                    E.KDVPItem(
-                        E.ItemID(str(i+1)),
-                        E.InventoryListType("PLVP"),
-                        E.Name(item.name),
-                        E.HasForeignTax("false"),
-                        E.HasLossTransfer("false"),
-                        E.ForeignTransfer("false"),
-                        E.TaxDecreaseConformance("false"),
-                        E.Securities(
-                            E.Code(item.name),
-                            E.IsFond(str(item.is_fond).lower()),
-                            *[
-                                E.Row(
-                                    E.ID(str(i)),
-                                    E.Sale(
-                                        E.F6(trade.date),
-                                        E.F7("{:.4f}".format(trade.quantity)),
-                                        E.F9("{:.4f}".format(trade.value)),
-                                        E.F10("true"),
-                                    ) if isinstance(trade, KDVPSecurityClose) else
-                                    E.Purchase(
-                                        E.F1(trade.date),
-                                        E.F2(trade.acquisition_type),
-                                        E.F3("{:.4f}".format(trade.quantity)),
-                                        E.F4("{:.4f}".format(trade.value)),
-                                    ),
-                                    E.F8("{:.4f}".format(trade.stock)),
-                                )
-                                for i, trade in enumerate(item.securities)
-                            ]
-                        ),
-                    )
-                    for i, item in enumerate(doh_kdvp.items.values())
-                ],
-            ),
-        ),
-    )
-
-    # Write the final XML file
-    xml = XMLWriter(args.output or "gains_furs.xml")
-    xml.write(envelope)
+                )
+            )
+            for i, item in enumerate(doh_kdvp.items.values()):
+                # Create the item's children in place with SubElement
+                kdvp_item = etree.Element("KDVPItem")
+                sub_element(kdvp_item, "ItemID", str(i + 1))
+                sub_element(kdvp_item, "InventoryListType", "PLVP")
+                sub_element(kdvp_item, "Name", item.name)
+                sub_element(kdvp_item, "HasForeignTax", "false")
+                sub_element(kdvp_item, "HasLossTransfer", "false")
+                sub_element(kdvp_item, "ForeignTransfer", "false")
+                sub_element(kdvp_item, "TaxDecreaseConformance", "false")
+                securities = etree.SubElement(kdvp_item, "Securities")
+                sub_element(securities, "Code", item.name)
+                sub_element(securities, "IsFond", str(item.is_fond).lower())
+                for j, trade in enumerate(item.securities):
+                    row = etree.SubElement(securities, "Row")
+                    sub_element(row, "ID", str(j))
+                    # Format the numbers once, both branches use the same values
+                    quantity = f"{trade.quantity:.4f}"
+                    value = f"{trade.value:.4f}"
+                    if isinstance(trade, KDVPSecurityClose):
+                        sale = etree.SubElement(row, "Sale")
+                        sub_element(sale, "F6", trade.date)
+                        sub_element(sale, "F7", quantity)
+                        sub_element(sale, "F9", value)
+                        sub_element(sale, "F10", "true")
+                    else:
+                        purchase = etree.SubElement(row, "Purchase")
+                        sub_element(purchase, "F1", trade.date)
+                        sub_element(purchase, "F2", trade.acquisition_type)
+                        sub_element(purchase, "F3", quantity)
+                        sub_element(purchase, "F4", value)
+                    sub_element(row, "F8", f"{trade.stock:.4f}")
+                doh_kdvp_element.write(kdvp_item)
     xml.verify("data/Doh_KDVP_9.xsd")
 
 
@@ -289,11 +347,11 @@ def main():
     args = parser.parse_args()
 
     # Create a cache object
-    company_cache = CompanyCache("company_cache.xml")
+    company_cache = CompanyCache("company_cache.json")
     if args.additional_info:
         company_cache.fill_isin_cache(args.additional_info)
         company_cache.flush()
-    country_cache = CountryCache("country_cache.xml")
+    country_cache = CountryCache("country_cache.json")
 
     # Process based on input
     if args.dividends:
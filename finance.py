@@ -1,40 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
 import yfinance as yf
 from cache import CompanyCache
 
+# Number of symbols fetched from Yahoo Finance concurrently
+MAX_WORKERS = 8
+# Fields of the ticker info that make up the payer address, in order
+ADDRESS_FIELDS = ("address1", "city", "state", "zip")
+
 
 class FinanceData:
     def __init__(self, cache: CompanyCache):
         self.cache = cache
 
     def fetch_info(self, symbols):
-        for symbol in symbols:
-            ticker = yf.Ticker(symbol.split(":")[0] if ":" in symbol else symbol)
-            address = self.cache.get_address(symbol)
-            if not address:
-                info = ticker.info
-                if info.get("address1"):
-                    address_components = [
-                        info.get("address1"),
-                        info.get("city"),
-                        info.get("state"),
-                        info.get("zip"),
-                    ]
-                    address = ", ".join(filter(None, address_components))
-                    self.cache.set_address(symbol, address)
-                    print("Address for", symbol, "is", address)
-                else:
-                    print("Address not found for", symbol)
-            # Getting ISIN is unreliable. Sometimes it picks the wrong country/exchange.
-            # TODO: Add ability to also provide the exchange to the Ticker object and then correctly fetch the ISIN.
-            # isin = self.cache.get_isin(ticker.ticker)
-            # if not isin:
-            #   _isin = ticker.isin
-            #   if _isin and re.match(r'^[A-Z]{2}[A-Z0-9]{9}[0-9]$', _isin):
-            #     isin = _isin
-            #     self.cache.set_isin(symbol, isin)
-            #     print("ISIN for", symbol, "is", isin)
-            #   else:
-            #     print("ISIN not found for", symbol)
+        # Only symbols without a cached address need a request, and a lookup that
+        # found no address is trusted until the end of the day it was made
+        today = date.today().isoformat()
+        missing = [
+            symbol
+            for symbol in symbols
+            if not self.cache.get_address(symbol)
+            and self.cache.get_address_not_found(symbol) != today
+        ]
+        # Listings of the same ticker on different exchanges share one request,
+        # run the requests concurrently
+        tickers = list(dict.fromkeys(symbol.split(":")[0] for symbol in missing))
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            infos = dict(zip(tickers, executor.map(self.ticker_info, tickers)))
+        for symbol in missing:
+            info = infos[symbol.split(":")[0]]
+            if info.get("address1"):
+                address = ", ".join(
+                    info[field] for field in ADDRESS_FIELDS if info.get(field)
+                )
+                self.cache.set_address(symbol, address)
+                print("Address for", symbol, "is", address)
+            else:
+                self.cache.set_address_not_found(symbol, today)
+                print("Address not found for", symbol)
+
+        # Getting ISIN is unreliable. Sometimes it picks the wrong country/exchange.
+        # TODO: Add ability to also provide the exchange to the Ticker object and then correctly fetch the ISIN.
+        # The ISIN isn't part of the ticker info, yfinance looks it up separately.
+        # for symbol in symbols:
+        #   if not self.cache.get_isin(symbol):
+        #     isin = yf.Ticker(symbol.split(":")[0]).isin
+        #     if isin and re.match(r'^[A-Z]{2}[A-Z0-9]{9}[0-9]$', isin):
+        #       self.cache.set_isin(symbol, isin)
+        #       print("ISIN for", symbol, "is", isin)
+        #     else:
+        #       print("ISIN not found for", symbol)
+
+    @staticmethod
+    def ticker_info(ticker):
+        return yf.Ticker(ticker).info
 
     def get_isin(self, ticker):
         return self.cache.get_isin(ticker)
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
 from typing import Literal
 
-@dataclass
+@dataclass(slots=True)
 class KDVPSecurity:
     date: str
     quantity: int
@@ -9,41 +10,56 @@ class KDVPSecurity:
     stock: int
 
 
-@dataclass
+@dataclass(slots=True)
 class KDVPSecurityOpen(KDVPSecurity):
     acquisition_type: Literal["A", "B"]  # Nacin pridobitve (there's more than A and B)
 
+    def merge_key(self):
+        return (KDVPSecurityOpen, self.date, self.value, self.acquisition_type)
 
-@dataclass
+
+@dataclass(slots=True)
 class KDVPSecurityClose(KDVPSecurity):
     loss_transfer: bool
 
+    def merge_key(self):
+        return (KDVPSecurityClose, self.date, self.value, self.loss_transfer)
+
 
-@dataclass
+@dataclass(slots=True)
 class KDVPItem:
     name: str
     is_fond: bool
     securities: list[KDVPSecurityOpen | KDVPSecurityClose]
 
+    # Trades that can be joined, keyed by their type, date, price and kind
+    _index: dict[tuple, KDVPSecurityOpen | KDVPSecurityClose] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        for s in self.securities:
+            self._index.setdefault(s.merge_key(), s)
+
     def update_trade(self, trade: KDVPSecurityOpen | KDVPSecurityClose) -> bool:
         # Check if a trade with the same date and price already exists and join them
-        for s in self.securities:
-            if s.date == trade.date and s.value == trade.value and type(s) == type(trade):
-                if isinstance(s, KDVPSecurityOpen) and s.acquisition_type == trade.acquisition_type:
-                    s.quantity += trade.quantity
-                    return True
-                if isinstance(s, KDVPSecurityClose) and s.loss_transfer == trade.loss_transfer:
-                    s.quantity += trade.quantity
-                    return True
-        return False
+        s = self._index.get(trade.merge_key())
+        if s is None:
+            return False
+        s.quantity += trade.quantity
+        return True
 
     def add_trade(self, trade: KDVPSecurityOpen | KDVPSecurityClose):
-        if not self.update_trade(trade):
-          self.securities.append(trade)
-          self.securities.sort(key=lambda x: x.date, reverse=False)
-        # Now go through and calculate the total stock value for each date
-        stock = 0
-        for s in self.securities:
+        if self.update_trade(trade):
+            index = bisect_left(self.securities, trade.date, key=lambda x: x.date)
+        else:
+            # Insert after the trades with the same date to keep the order stable
+            index = bisect_right(self.securities, trade.date, key=lambda x: x.date)
+            self.securities.insert(index, trade)
+            self._index[trade.merge_key()] = trade
+        # Only the stock from the changed trade onward needs to be recalculated
+        stock = self.securities[index - 1].stock if index > 0 else 0
+        for s in self.securities[index:]:
             if isinstance(s, KDVPSecurityOpen):
                 stock += s.quantity
             else:
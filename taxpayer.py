@@ -1,6 +1,28 @@
 import dataclasses
+import functools
+import os
 from lxml import etree
 
+# Fields of the taxpayer in the order they are asked for, with their prompt labels
+LABELS = {
+    "taxNumber": "tax number",
+    "name": "name",
+    "address": "address",
+    "city": "city",
+    "postNumber": "post number",
+    "postName": "post name",
+    "email": "email",
+    "phone": "phone",
+    "birthDate": "birth date",
+}
+
+
+@functools.lru_cache(maxsize=16)
+def _read(path, mtime):
+    # Keyed by the modification time so a saved file is read again
+    root = etree.parse(path).getroot()
+    return {el.tag: el.text or "" for el in root}
+
 
 @dataclasses.dataclass
 class Taxpayer:
@@ -17,130 +39,43 @@ class Taxpayer:
     def __init__(self):
         self.path = "data/taxpayer.xml"
         try:
-            tree = etree.parse(self.path)
-            root = tree.getroot()
-            self.taxNumber = root.findtext("taxNumber")
-            self.name = root.findtext("name")
-            self.address = root.findtext("address")
-            self.city = root.findtext("city")
-            self.postNumber = root.findtext("postNumber")
-            self.postName = root.findtext("postName")
-            self.email = root.findtext("email")
-            self.phone = root.findtext("phone")
-            self.birthDate = root.findtext("birthDate")
+            data = _read(self.path, os.path.getmtime(self.path))
         except (OSError, AttributeError):
-            self.taxNumber = None
-            self.name = None
-            self.address = None
-            self.city = None
-            self.postNumber = None
-            self.postName = None
-            self.email = None
-            self.phone = None
-            self.birthDate = None
+            data = None
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, data.get(field.name) if data else None)
+        if data is None:
             self.get_input()
 
     def save(self):
         with etree.xmlfile(self.path, encoding="utf-8") as xf:
             xf.write_declaration()
             root = etree.Element("taxpayer")
-            for key, value in dataclasses.asdict(self).items():
-                el = etree.SubElement(root, key)
-                el.text = value
+            for field in dataclasses.fields(self):
+                el = etree.SubElement(root, field.name)
+                el.text = getattr(self, field.name)
             xf.write(root, pretty_print=True)
 
     def get_input(self):
         # If we have all the data, we can ask the user to verify it at once
-        if all(
-            [
-                self.taxNumber,
-                self.name,
-                self.address,
-                self.city,
-                self.postNumber,
-                self.postName,
-                self.email,
-                self.phone,
-                self.birthDate,
-            ]
-        ):
-            verification = input(
-                f"Is this information correct?\nTax number: {self.taxNumber}\nName: {self.name}\nAddress: {self.address}\nCity: {self.city}\nPost number: {self.postNumber}\nPost name: {self.postName}\nEmail: {self.email}\nPhone: {self.phone}\nBirth date: {self.birthDate}\n(Y/N): "
+        if all(getattr(self, key) for key in LABELS):
+            summary = "\n".join(
+                f"{label.capitalize()}: {getattr(self, key)}"
+                for key, label in LABELS.items()
             )
-            if verification.upper() != "Y" and verification != "":
-                self.taxNumber = input("Enter your tax number: ")
-                self.name = input("Enter your name: ")
-                self.address = input("Enter your address: ")
-                self.city = input("Enter your city: ")
-                self.postNumber = input("Enter your post number: ")
-                self.postName = input("Enter your post name: ")
-                self.email = input("Enter your email: ")
-                self.phone = input("Enter your phone: ")
-                self.birthDate = input("Enter your birth date: ")
+            verification = input(f"Is this information correct?\n{summary}\n(Y/N): ")
+            if verification.upper() not in ("Y", ""):
+                for key, label in LABELS.items():
+                    setattr(self, key, input(f"Enter your {label}: "))
             self.save()
             return
 
-        if not self.taxNumber:
-            self.taxNumber = input("Enter your tax number: ")
-        else:
-            verification = input(f"Is your tax number {self.taxNumber}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.taxNumber = input("Enter your tax number: ")
-
-        if not self.name:
-            self.name = input("Enter your name: ")
-        else:
-            verification = input(f"Is your name {self.name}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.name = input("Enter your name: ")
-
-        if not self.address:
-            self.address = input("Enter your address: ")
-        else:
-            verification = input(f"Is your address {self.address}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.address = input("Enter your address: ")
-
-        if not self.city:
-            self.city = input("Enter your city: ")
-        else:
-            verification = input(f"Is your city {self.city}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.city = input("Enter your city: ")
-
-        if not self.postNumber:
-            self.postNumber = input("Enter your post number: ")
-        else:
-            verification = input(f"Is your post number {self.postNumber}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.postNumber = input("Enter your post number: ")
-
-        if not self.postName:
-            self.postName = input("Enter your post name: ")
-        else:
-            verification = input(f"Is your post name {self.postName}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.postName = input("Enter your post name: ")
-
-        if not self.email:
-            self.email = input("Enter your email: ")
-        else:
-            verification = input(f"Is your email {self.email}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.email = input("Enter your email: ")
-
-        if not self.phone:
-            self.phone = input("Enter your phone: ")
-        else:
-            verification = input(f"Is your phone {self.phone}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.phone = input("Enter your phone: ")
-        
-        if not self.birthDate:
-            self.birthDate = input("Enter your birth date: ")
-        else:
-            verification = input(f"Is your birth date {self.birthDate}? (Y/N): ")
-            if verification.upper() != "Y":
-                self.birthDate = input("Enter your birth date: ")
-        
+        # Otherwise ask for the missing values and confirm the known ones one by one
+        for key, label in LABELS.items():
+            value = getattr(self, key)
+            if value:
+                verification = input(f"Is your {label} {value}? (Y/N): ")
+                if verification.upper() in ("Y", ""):
+                    continue
+            setattr(self, key, input(f"Enter your {label}: "))
         self.save()
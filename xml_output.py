@@ -1,11 +1,32 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
 import pandas as pd
 from lxml import etree
 from lxml.builder import ElementMaker
 
+EDP_NS = "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd"
+# Shared tag builders for the unqualified document elements and the edp: elements
+E = ElementMaker()
+EDP = ElementMaker(namespace=EDP_NS, nsmap={"edp": EDP_NS})
+
+
+def sub_element(parent: etree.Element, tag: str, text: str) -> etree.Element:
+    element = etree.SubElement(parent, tag)
+    element.text = text
+    return element
+
+
+@lru_cache(maxsize=4)
+def _load_schema(path: str) -> etree.XMLSchema:
+    # Compiling the xsd is costly, keep it around for repeated verifications
+    return etree.XMLSchema(etree.parse(path))
+
 
 class XML:
     MAIN_NS = "http://edavki.durs.si/Documents/Schemas/Doh_Div_3.xsd"
-    EDP_NS = "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd"
 
     def __init__(self, taxpayer, df: pd.DataFrame, path: str, correction: bool) -> None:
         self.taxpayer = taxpayer
@@ -14,29 +35,25 @@ class XML:
         self.correction = correction
 
     def write(self):
-        E = ElementMaker(nsmap={"edp": self.EDP_NS})
-        EDP = ElementMaker(namespace=self.EDP_NS)
-        envelope = E.Envelope(
-            {"xmlns": self.MAIN_NS},
-            EDP.Header(
-                EDP.taxpayer(
-                    EDP.taxNumber(self.taxpayer.taxNumber),
-                    EDP.taxpayerType("FO"),
-                    EDP.name(self.taxpayer.name),
-                    EDP.address1(self.taxpayer.address),
-                    EDP.city(self.taxpayer.city),
-                    EDP.postNumber(self.taxpayer.postNumber),
-                    EDP.postName(self.taxpayer.postName),
-                ),
-                EDP.Workflow(
-                    EDP.DocumentWorkflowID("P" if self.correction else "O"),
-                    EDP.DocumentWorkflowName(),
-                ),
-                EDP.domain("edavki.durs.si"),
+        header = EDP.Header(
+            EDP.taxpayer(
+                EDP.taxNumber(self.taxpayer.taxNumber),
+                EDP.taxpayerType("FO"),
+                EDP.name(self.taxpayer.name),
+                EDP.address1(self.taxpayer.address),
+                EDP.city(self.taxpayer.city),
+                EDP.postNumber(self.taxpayer.postNumber),
+                EDP.postName(self.taxpayer.postName),
             ),
-            EDP.AttachmentList(),
-            EDP.Signatures(),
-            E.body(
+            EDP.Workflow(
+                EDP.DocumentWorkflowID("P" if self.correction else "O"),
+                EDP.DocumentWorkflowName(),
+            ),
+            EDP.domain("edavki.durs.si"),
+        )
+        # Stream the envelope so only one dividend element is kept in memory at a time
+        with self.xml.envelope(self.MAIN_NS, header) as body:
+            body.write(
                 E.Doh_Div(
                     E.Period(str(pd.Timestamp.now().year - 1)),
                     E.EmailAddress(self.taxpayer.email),
@@ -45,8 +62,16 @@ class XML:
                     E.IsResident("true"),
                     E.SelfReport("false"),
                     E.WfTypeU("false"),
-                ),
-                *[
+                )
+            )
+            # Format the dates and amounts for the whole column at once
+            df = self.df.assign(
+                Date=self.df["Date"].dt.strftime("%Y-%m-%d"),
+                Value=self.df["Value"].map("{:.2f}".format),
+                ForeignTax=self.df["ForeignTax"].map("{:.2f}".format),
+            )
+            for row in df.itertuples():
+                body.write(
                     E.Dividend(
                         E.Date(row.Date),
                         E.PayerIdentificationNumber(row.PayerIdentificationNumber),
@@ -54,34 +79,92 @@ class XML:
                         E.PayerAddress(row.PayerAddress),
                         E.PayerCountry(row.PayerCountry),
                         E.Type("1"),
-                        E.Value("{:.2f}".format(row.Value)),
-                        E.ForeignTax("{:.2f}".format(row.ForeignTax)),
+                        E.Value(row.Value),
+                        E.ForeignTax(row.ForeignTax),
                         E.SourceCountry(row.PayerCountry),
                         E.ReliefStatement(row.ReliefStatement),
                     )
-                    for row in self.df.itertuples()
-                ],
-            ),
-        )
-        self.xml.write(envelope)
+                )
 
     def verify(self, schema_path: str):
         self.xml.verify(schema_path)
 
+
+class IndentedWriter:
+    # Writes elements into an xmlfile at a nesting level, indented like pretty_print
+    INDENT = "  "
+
+    def __init__(self, xf, level: int) -> None:
+        self.xf = xf
+        self.level = level
+
+    def newline(self, level: int):
+        self.xf.write("\n" + self.INDENT * level)
+
+    def write(self, element: etree.Element):
+        self.newline(self.level)
+        if etree.QName(element).namespace:
+            # lxml declares the namespaces again on every subtree it writes, so write
+            # the edp elements tag by tag to use the prefix declared on the envelope
+            self.write_tags(element, self.level)
+        else:
+            etree.indent(element, space=self.INDENT, level=self.level)
+            self.xf.write(element)
+
+    def write_tags(self, element: etree.Element, level: int):
+        with self.xf.element(element.tag, dict(element.attrib)):
+            if element.text:
+                self.xf.write(element.text)
+            for child in element:
+                self.newline(level + 1)
+                self.write_tags(child, level + 1)
+            if len(element):
+                self.newline(level)
+
+    @contextmanager
+    def element(self, tag: str):
+        self.newline(self.level)
+        with self.xf.element(tag):
+            yield IndentedWriter(self.xf, self.level + 1)
+            self.newline(self.level)
+
+
 class XMLWriter:
     def __init__(self, path: str) -> None:
         self.path = path
 
-    def write(self, element: etree.Element):
-        # Write the xml to a file pretty printed with an xml declaration
-        with etree.xmlfile(self.path, encoding="utf-8") as xf:
-            xf.write_declaration()
-            xf.write(element, pretty_print=True)
-            print("XML file written to ", self.path)
+    @contextmanager
+    def envelope(self, namespace: str, header: etree.Element):
+        # Write the envelope incrementally, the caller streams the body content into it.
+        # Stream into a temporary file next to the output and only move it into place
+        # once the whole body was written, so a failure never leaves a partial report
+        f = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp", delete=False
+        )
+        try:
+            with f:
+                with etree.xmlfile(f, encoding="utf-8") as xf:
+                    xf.write_declaration()
+                    nsmap = {"edp": EDP_NS}
+                    with xf.element("Envelope", {"xmlns": namespace}, nsmap=nsmap):
+                        envelope = IndentedWriter(xf, 1)
+                        envelope.write(header)
+                        envelope.write(EDP.AttachmentList())
+                        envelope.write(EDP.Signatures())
+                        with envelope.element("body") as body:
+                            yield body
+                        xf.write("\n")
+                # Text can't be written after the root element, end the file directly
+                f.write(b"\n")
+            os.replace(f.name, self.path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+        print("XML file written to ", self.path)
 
     def verify(self, schema_path: str):
         # Verify the generated XML using an xsd schema
-        schema = etree.XMLSchema(etree.parse(schema_path))
-        xml = etree.parse(self.path)
-        schema.assertValid(xml)
+        schema = _load_schema(schema_path)
+        # Validate while parsing instead of walking the parsed tree a second time
+        etree.parse(self.path, etree.XMLParser(schema=schema))
         print("XML is valid according to schema ", schema_path)
\ No newline at end of file
@@ -0,0 +1,5 @@
+def discard(element):
+    # Free the element and any already processed siblings so the tree doesn't grow
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]